@@ -120,6 +120,24 @@ def subs(Av,expr_old,expr_new):
 	return smarr.MutableDenseNDimArray(Av_sub)
 
 
+def xreplace_dict(Old,New):
+	'''
+	Build the dictionary replacing each element of Old with the corresponding
+	element of New, to be used with the xreplace method. Unlike subs, xreplace
+	only matches exact expression trees: as sympy distributes the sign over
+	sums (e.g. -(a-b) is stored as -a+b), negated entries are also included.
+	'''
+
+	assert len(Old)==len(New), 'Array dimension not matching'
+
+	Rdict={}
+	for ii in range(len(Old)):
+		Rdict[Old[ii]]=New[ii]
+		Rdict[-Old[ii]]=-New[ii]
+
+	return Rdict
+
+
 def scalar_deriv(a,xList):
 	'''Compute derivatives of a scalar w.r.t. a list of valirables'''
 
@@ -1,6 +1,10 @@
 '''
 Analytical linearisation of uc*dnc/dzeta
 
+The derivation is only performed on first access to its results (e.g.
+``linsym_uc_dncdzeta.Der``) or when the module is run as a script, so that
+importing the module is cheap.
+
 Sign convention:
 
 Scalar quantities are all lower case, e.g. zeta
@@ -10,6 +14,7 @@ Arrays begin with upper case, e.g. Zeta_i
 
 '''
 
+import functools
 import numpy as np
 import sympy as sm
 import sympy.tensor.array as smarr
@@ -52,103 +57,132 @@ uc_x, uc_y, uc_z=sm.symbols('uc_x uc_y uc_z', real=True)
 Uc=smarr.MutableDenseNDimArray([uc_x,uc_y,uc_z])
 
 
-### Compute normal to panel
-# see surface.AeroGridSurface.get_panel_normal
-R02=Zeta02-Zeta00
-R13=Zeta03-Zeta01
-Norm=linfunc.cross_product(R02,R13)
-Norm=Norm/linfunc.norm2(Norm)
-### check norm
-assert linfunc.scalar_product(Norm,R02).simplify()==0, 'Norm is wrong'
-assert linfunc.scalar_product(Norm,R13).simplify()==0, 'Norm is wrong'
-assert linfunc.scalar_product(Norm,Norm).simplify()==1, 'Normal is not unit length'
-
-
-### Compute normal velocity at panel
-Unorm=linfunc.scalar_product(Norm,Uc)
-Unorm=sm.simplify(Unorm)
-
-### Compute derivative
-dUnorm_dZeta=sm.derive_by_array(Unorm,[Zeta00,Zeta01,Zeta02,Zeta03])
-#dUnorm_dZeta=linfunc.simplify(dUnorm_dZeta)
-
-
-
-################################################################################
-### exploit combined derivatives
-################################################################################
-
-
-dR_dZeta=sm.derive_by_array([R02,R13],[Zeta00,Zeta01,Zeta02,Zeta03])
-
-### redefine R02,R13
+### panel diagonals as symbols
 r02_x,r02_y,r02_z=sm.symbols('r02_x r02_y r02_z', real=True)
 r13_x,r13_y,r13_z=sm.symbols('r13_x r13_y r13_z', real=True)
-R02=smarr.MutableDenseNDimArray([r02_x,r02_y,r02_z])
-R13=smarr.MutableDenseNDimArray([r13_x,r13_y,r13_z])
-
-Norm=linfunc.cross_product(R02,R13)
-Norm=Norm/linfunc.norm2(Norm)
-### check norm
-assert linfunc.scalar_product(Norm,R02).simplify()==0, 'Norm is wrong'
-assert linfunc.scalar_product(Norm,R13).simplify()==0, 'Norm is wrong'
-assert linfunc.scalar_product(Norm,Norm).simplify()==1, 'Normal is not unit length'
-### Compute normal velocity at panel
-Unorm=linfunc.scalar_product(Norm,Uc)
-Unorm=sm.simplify(Unorm)
-# derivative
-dUnorm_dR=sm.derive_by_array(Unorm,[R02,R13])
-
-
-### shorten equations
-Der=dUnorm_dR
-
-
-eq_crR13Uc=linfunc.cross_product(R13,Uc)
-eq_crR02Uc=linfunc.cross_product(R02,Uc)
-eq_crR02R13=linfunc.cross_product(R02,R13)
-crR13Uc_x,crR13Uc_y,crR13Uc_z=sm.symbols('crR13Uc_x crR13Uc_y crR13Uc_z',real=True)
-crR02Uc_x,crR02Uc_y,crR02Uc_z=sm.symbols('crR02Uc_x crR02Uc_y crR02Uc_z',real=True)
-crR02R13_x,crR02R13_y,crR02R13_z=sm.symbols('crR02R13_x crR02R13_y crR02R13_z',real=True)
-
-crR13Uc=smarr.MutableDenseNDimArray([crR13Uc_x,crR13Uc_y,crR13Uc_z])
-crR02Uc=smarr.MutableDenseNDimArray([crR02Uc_x,crR02Uc_y,crR02Uc_z])
-crR02R13=smarr.MutableDenseNDimArray([crR02R13_x,crR02R13_y,crR02R13_z])
-for cc in range(3):
-	Der=Der.subs(eq_crR02Uc[cc],crR02Uc[cc])
-	Der=Der.subs(eq_crR13Uc[cc],crR13Uc[cc])
-	Der=Der.subs(eq_crR02R13[cc],crR02R13[cc])
-norm_crR02R13=sm.symbols('norm_crR02R13',real=True)
-cub_crR02R13=sm.symbols('cub_crR02R13',real=True)
-Der=Der.subs(sm.sqrt(crR02R13_x**2 + crR02R13_y**2 + crR02R13_z**2),norm_crR02R13)
-Der=Der.subs(norm_crR02R13**3,cub_crR02R13)
-
-# other products
-eq_Acr=linfunc.cross_product(crR02R13,R13)
-Acr_x,Acr_y,Acr_z=sm.symbols('Acr_x Acr_y Acr_z',real=True)
-Acr=sm.MutableDenseNDimArray([Acr_x,Acr_y,Acr_z])
-for cc in range(3):
-	Der=Der.subs(eq_Acr[cc],Acr[cc])
-
-eq_Bcr=linfunc.cross_product(crR02R13,R02)
-Bcr_x,Bcr_y,Bcr_z=sm.symbols('Bcr_x Bcr_y Bcr_z',real=True)
-Bcr=sm.MutableDenseNDimArray([Bcr_x,Bcr_y,Bcr_z])
-for cc in range(3):
-	Der=Der.subs(eq_Bcr[cc],Bcr[cc])
-
-eq_Cdot=linfunc.scalar_product(crR02R13,Uc)
-Cdot=sm.symbols('Cdot',real=True)
-Der=Der.subs(eq_Cdot,Cdot)
-
-
-
-
-
-
-
-
-
-
-
 
 
+@functools.lru_cache(maxsize=1)
+def build_dUnorm():
+	'''
+	Derive the normal velocity at the panel collocation point, Unorm, w.r.t.
+	the panel vertices (dUnorm_dZeta) and w.r.t. the panel diagonals
+	(dUnorm_dR), and the latter in compact form (Der).
+
+	Returns a dictionary with the results, which is cached after the first call.
+	'''
+
+	### Compute normal to panel
+	# see surface.AeroGridSurface.get_panel_normal
+	R02=Zeta02-Zeta00
+	R13=Zeta03-Zeta01
+	Norm=linfunc.cross_product(R02,R13)
+	Norm=Norm/linfunc.norm2(Norm)
+	# zeta differences appear verbatim in Norm, so xreplace (exact tree match) is
+	# enough to swap them and much cheaper than subs
+	subs_R=linfunc.xreplace_dict(list(R02)+list(R13),
+	                             [r02_x,r02_y,r02_z,r13_x,r13_y,r13_z])
+
+	### check norm - expanding (or bringing to a single fraction) is enough to
+	# verify these identities, there is no need for the full simplify
+	assert sm.expand(linfunc.scalar_product(Norm,R02).xreplace(subs_R))==0, 'Norm is wrong'
+	assert sm.expand(linfunc.scalar_product(Norm,R13).xreplace(subs_R))==0, 'Norm is wrong'
+	assert sm.together(linfunc.scalar_product(Norm,Norm).xreplace(subs_R))==1, 'Normal is not unit length'
+
+
+	### Compute normal velocity at panel
+	Unorm=linfunc.scalar_product(Norm,Uc)
+	Unorm=sm.together(Unorm)
+
+	### Compute derivative
+	dUnorm_dZeta=sm.derive_by_array(Unorm,[Zeta00,Zeta01,Zeta02,Zeta03])
+	#dUnorm_dZeta=linfunc.simplify(dUnorm_dZeta)
+
+
+	################################################################################
+	### exploit combined derivatives
+	################################################################################
+
+
+	dR_dZeta=sm.derive_by_array([R02,R13],[Zeta00,Zeta01,Zeta02,Zeta03])
+
+	### redefine R02,R13
+	R02=smarr.MutableDenseNDimArray([r02_x,r02_y,r02_z])
+	R13=smarr.MutableDenseNDimArray([r13_x,r13_y,r13_z])
+
+	Norm=linfunc.cross_product(R02,R13)
+	Norm=Norm/linfunc.norm2(Norm)
+	### check norm - expanding (or bringing to a single fraction) is enough to
+	# verify these identities, there is no need for the full simplify
+	assert sm.expand(linfunc.scalar_product(Norm,R02))==0, 'Norm is wrong'
+	assert sm.expand(linfunc.scalar_product(Norm,R13))==0, 'Norm is wrong'
+	assert sm.together(linfunc.scalar_product(Norm,Norm))==1, 'Normal is not unit length'
+	### Compute normal velocity at panel
+	Unorm=linfunc.scalar_product(Norm,Uc)
+	Unorm=sm.together(Unorm)
+	# derivative
+	dUnorm_dR=sm.derive_by_array(Unorm,[R02,R13])
+
+
+	### shorten equations
+	Der=dUnorm_dR
+
+
+	eq_crR13Uc=linfunc.cross_product(R13,Uc)
+	eq_crR02Uc=linfunc.cross_product(R02,Uc)
+	eq_crR02R13=linfunc.cross_product(R02,R13)
+	crR13Uc_x,crR13Uc_y,crR13Uc_z=sm.symbols('crR13Uc_x crR13Uc_y crR13Uc_z',real=True)
+	crR02Uc_x,crR02Uc_y,crR02Uc_z=sm.symbols('crR02Uc_x crR02Uc_y crR02Uc_z',real=True)
+	crR02R13_x,crR02R13_y,crR02R13_z=sm.symbols('crR02R13_x crR02R13_y crR02R13_z',real=True)
+
+	crR13Uc=smarr.MutableDenseNDimArray([crR13Uc_x,crR13Uc_y,crR13Uc_z])
+	crR02Uc=smarr.MutableDenseNDimArray([crR02Uc_x,crR02Uc_y,crR02Uc_z])
+	crR02R13=smarr.MutableDenseNDimArray([crR02R13_x,crR02R13_y,crR02R13_z])
+	# exact matches only: a single xreplace walk replaces all components
+	subs_cr=linfunc.xreplace_dict(list(eq_crR02Uc)+list(eq_crR13Uc)+list(eq_crR02R13),
+	                              list(crR02Uc)+list(crR13Uc)+list(crR02R13))
+	Der=Der.xreplace(subs_cr)
+	# powers of the norm need the algebraic matching of subs
+	norm_crR02R13=sm.symbols('norm_crR02R13',real=True)
+	cub_crR02R13=sm.symbols('cub_crR02R13',real=True)
+	Der=Der.subs(sm.sqrt(crR02R13_x**2 + crR02R13_y**2 + crR02R13_z**2),norm_crR02R13)
+	Der=Der.subs(norm_crR02R13**3,cub_crR02R13)
+
+	# other products
+	eq_Acr=linfunc.cross_product(crR02R13,R13)
+	Acr_x,Acr_y,Acr_z=sm.symbols('Acr_x Acr_y Acr_z',real=True)
+	Acr=sm.MutableDenseNDimArray([Acr_x,Acr_y,Acr_z])
+	Der=Der.xreplace(linfunc.xreplace_dict(eq_Acr,Acr))
+
+	eq_Bcr=linfunc.cross_product(crR02R13,R02)
+	Bcr_x,Bcr_y,Bcr_z=sm.symbols('Bcr_x Bcr_y Bcr_z',real=True)
+	Bcr=sm.MutableDenseNDimArray([Bcr_x,Bcr_y,Bcr_z])
+	Der=Der.xreplace(linfunc.xreplace_dict(eq_Bcr,Bcr))
+
+	eq_Cdot=linfunc.scalar_product(crR02R13,Uc)
+	Cdot=sm.symbols('Cdot',real=True)
+	Der=Der.xreplace(linfunc.xreplace_dict([eq_Cdot],[Cdot]))
+
+	return {'Unorm':Unorm,
+	        'dUnorm_dZeta':dUnorm_dZeta,
+	        'dR_dZeta':dR_dZeta,
+	        'dUnorm_dR':dUnorm_dR,
+	        'Der':Der}
+
+
+### results of build_dUnorm, available as module attributes
+derived_names=('Unorm','dUnorm_dZeta','dR_dZeta','dUnorm_dR','Der')
+
+
+def __getattr__(name):
+	'''
+	Lazily build the derivatives on first access to any of them. Any other
+	missing attribute (e.g. probes by inspect or sphinx) fails straight away
+	'''
+	if name not in derived_names:
+		raise AttributeError('module %s has no attribute %s' %(__name__,name))
+	return build_dUnorm()[name]
+
+
+if __name__=='__main__':
+	globals().update(build_dUnorm())
@@ -1,5 +1,7 @@
 """Krylov-subspaces model order reduction techniques
 """
+import os
+import concurrent.futures
 import numpy as np
 import scipy.linalg as sclalg
 import sharpy.linear.src.libss as libss
@@ -114,6 +116,9 @@ class Krylov(rom_interface.BaseRom):
         self.cpu_summary = dict()
         self.eigenvalue_table = None
 
+        self.lu_cache = dict()  # LU factorisations of (sigma I - A) keyed by sigma
+        self.lu_cache_a = None  # Plant matrix the cached factorisations belong to
+
     def initialise(self, in_settings=None):
 
         if in_settings is not None:
@@ -133,13 +138,10 @@ class Krylov(rom_interface.BaseRom):
                                       'could be that is not yet implemented'
                                       % self.algorithm)
 
-        self.frequency = np.array(self.settings['frequency'])
+        self.frequency = np.atleast_1d(self.settings['frequency'])
+        self.nfreq = self.frequency.size
         self.r = self.settings['r'].value
         self.restart_arnoldi = self.settings['restart_arnoldi'].value
-        try:
-            self.nfreq = self.frequency.shape[0]
-        except AttributeError:
-            self.nfreq = 1
 
     def run(self, ss):
         """
@@ -164,6 +166,9 @@ class Krylov(rom_interface.BaseRom):
             (libss.ss): Reduced state space system
         """
         self.ss = ss
+        if self.lu_cache_a is not ss.A:
+            self.lu_cache = dict()
+            self.lu_cache_a = ss.A
 
         if self.settings['print_info']:
             cout.cout_wrap('Model Order Reduction in progress...')
@@ -211,10 +216,54 @@ class Krylov(rom_interface.BaseRom):
         if self.frequency.dtype == complex:
             cout.cout_wrap(self.nfreq * '\t\tsigma = %4f + %4fj [rad/s]\n' %tuple(self.frequency.view(float)), 1)
         else:
-            cout.cout_wrap(self.nfreq * '\t\tsigma = %4f [rad/s]\n' % self.frequency, 1)
+            cout.cout_wrap(self.nfreq * '\t\tsigma = %4f [rad/s]\n' % tuple(self.frequency), 1)
         cout.cout_wrap('\tKrylov order:')
         cout.cout_wrap('\t\tr = %d' % self.r, 1)
 
+    def lu_factor(self, sigma):
+        r"""
+        LU factorisation of :math:`(\sigma\mathbf{I} - \mathbf{A})` for the current full order system.
+
+        Factorisations are cached across calls to :meth:`run` while the plant matrix of the system remains the same
+        object, such that reductions of different order about the same interpolation points only factorise once.
+
+        Args:
+            sigma (complex): Interpolation point
+
+        Returns:
+            tuple or SuperLU: LU factorisation as returned by :func:`sharpy.rom.utils.krylovutils.lu_factor`.
+        """
+        try:
+            lu_a = self.lu_cache[sigma]
+        except KeyError:
+            lu_a = krylovutils.lu_factor(sigma, self.ss.A)
+            self.lu_cache[sigma] = lu_a
+
+        return lu_a
+
+    def lu_factor_all(self, frequencies):
+        r"""
+        Computes the LU factorisations of :math:`(\sigma_i\mathbf{I} - \mathbf{A})` for all the finite interpolation
+        points :math:`\sigma_i` that are not yet cached (see :meth:`lu_factor`).
+
+        The factorisations are independent of each other and LAPACK releases the GIL, so they are run concurrently
+        in a pool of threads.
+
+        Args:
+            frequencies (list or np.ndarray): Interpolation points
+        """
+        pending = [sigma for sigma in dict.fromkeys(frequencies)
+                   if sigma != np.inf and sigma not in self.lu_cache]
+
+        if len(pending) < 2:
+            return
+
+        n_workers = min(len(pending), os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            lu_list = executor.map(lambda sigma: krylovutils.lu_factor(sigma, self.ss.A), pending)
+            for sigma, lu_a in zip(pending, lu_list):
+                self.lu_cache[sigma] = lu_a
+
     def one_sided_arnoldi(self, frequency, r):
         r"""
         One-sided Arnoldi method expansion about a single interpolation point, :math:`\sigma`.
@@ -256,15 +305,20 @@ class Krylov(rom_interface.BaseRom):
 
         nx = A.shape[0]
 
+        # Single interpolation point, given either as a scalar or as the one element array in the settings
+        frequency = np.atleast_1d(frequency)
+        if frequency.size != 1:
+            raise ValueError('Single interpolation point expected, %d given' % frequency.size)
+        frequency = frequency[0]
+
         if frequency != np.inf and frequency is not None:
-            lu_A = krylovutils.lu_factor(frequency, A)
+            lu_A = self.lu_factor(frequency)
             V = krylovutils.construct_krylov(r, lu_A, B, 'Pade', 'b')
         else:
             V = krylovutils.construct_krylov(r, A, B, 'partial_realisation', 'b')
 
         # Reduced state space model
-        Ar = V.T.dot(A.dot(V))
-        Br = V.T.dot(B)
+        Ar, Br = project(V, A, V, B)
         Cr = C.dot(V)
 
         self.V = V
@@ -308,24 +362,34 @@ class Krylov(rom_interface.BaseRom):
 
         nx = A.shape[0]
 
+        # Single interpolation point, given either as a scalar or as the one element array in the settings
+        frequency = np.atleast_1d(frequency)
+        if frequency.size != 1:
+            raise ValueError('Single interpolation point expected, %d given' % frequency.size)
+        frequency = frequency[0]
+
         if frequency != np.inf and frequency is not None:
-            lu_A = krylovutils.lu_factor(frequency, A)
+            lu_A = self.lu_factor(frequency)
             V = krylovutils.construct_krylov(r, lu_A, B, 'Pade', 'b')
             W = krylovutils.construct_krylov(r, lu_A, C.T, 'Pade', 'c')
         else:
             V = krylovutils.construct_krylov(r, A, B, 'partial_realisation', 'b')
             W = krylovutils.construct_krylov(r, A, C.T, 'partial_realisation', 'c')
 
+        # Either space may be truncated on breakdown. Keep the same number of moments on both sides
+        r = min(V.shape[1], W.shape[1])
+        V = V[:, :r]
+        W = W[:, :r]
+
         T = W.T.dot(V)
-        Tinv = sclalg.inv(T)
-        reduction_checks(T, Tinv)
+        V_tinv = solve_v_tinv(T, V)
+        reduction_checks(T, W, V_tinv)
         self.W = W
         self.V = V
 
         # Reduced state space model
-        Ar = W.T.dot(self.ss.A.dot(V.dot(Tinv)))
-        Br = W.T.dot(self.ss.B)
-        Cr = self.ss.C.dot(V.dot(Tinv))
+        Ar, Br = project(W, self.ss.A, V_tinv, self.ss.B)
+        Cr = self.ss.C.dot(V_tinv)
 
         return Ar, Br, Cr
 
@@ -350,7 +414,8 @@ class Krylov(rom_interface.BaseRom):
         C = self.ss.C
 
         nx = A.shape[0]
-        nfreq = frequency.shape[0]
+        frequency = np.atleast_1d(frequency)
+        nfreq = frequency.size
 
         # Columns of matrix v
         v_ncols = 2 * np.sum(r)
@@ -363,7 +428,7 @@ class Krylov(rom_interface.BaseRom):
         res = np.zeros((nx,v_ncols+2),
                        dtype=float)
 
-        # lu_A = krylovutils.lu_factor(frequency[0] * np.eye(nx) - A)
+        # lu_A = self.lu_factor(frequency[0])
         v_res = sclalg.lu_solve(lu_A, B)
 
         H[0, 0] = np.linalg.norm(v_res)
@@ -398,7 +463,7 @@ class Krylov(rom_interface.BaseRom):
                 # V[:, k + 1] = res[:, k] / np.linalg.norm(res[:, k])
                 #
                 # if j == r[i] - 1 and i < nfreq - 1:
-                #     lu_A = krylovutils.lu_factor(frequency[i+1] * np.eye(nx) - A)
+                #     lu_A = self.lu_factor(frequency[i+1])
                 #     v_res = sclalg.lu_solve(lu_A, B)
                 # else:
                 #     v_res = - sclalg.lu_solve(lu_A, V[:, k+1])
@@ -428,7 +493,7 @@ class Krylov(rom_interface.BaseRom):
                 V[:, k+1] = res[:, k] / H[k+1, k]
 
                 if j == r[i] - 1 and i < nfreq - 1:
-                    lu_A = krylovutils.lu_factor(frequency[i+1], A)
+                    lu_A = self.lu_factor(frequency[i+1])
                     v_res = sclalg.lu_solve(lu_A, B)
                 else:
                     v_res = - sclalg.lu_solve(lu_A, V[:, k+1])
@@ -445,8 +510,7 @@ class Krylov(rom_interface.BaseRom):
         self.V = V
         self.H = H
 
-        Ar = V.T.dot(A.dot(V))
-        Br = V.T.dot(B)
+        Ar, Br = project(V, A, V, B)
         Cr = C.dot(V)
 
         return Ar, Br, Cr
@@ -500,6 +564,9 @@ class Krylov(rom_interface.BaseRom):
 
         B.shape = (nx, nu)
 
+        frequency = np.atleast_1d(frequency)
+        nfreq = frequency.size
+
         if nu != 1:
             left_tangent, right_tangent, rc, ro, fc, fo = self.load_tangent_vectors()
             assert right_tangent is not None and left_tangent is not None, 'Missing interpolation vectors for MIMO case'
@@ -513,12 +580,6 @@ class Krylov(rom_interface.BaseRom):
             right_tangent[0, :] = 1
             left_tangent[0, :] = 1
 
-        try:
-            nfreq = frequency.shape[0]
-        except AttributeError:
-            nfreq = 1
-
-
         t0 = time.time()
         # # Tangential interpolation for MIMO systems
         # if right_tangent is None:
@@ -531,12 +592,9 @@ class Krylov(rom_interface.BaseRom):
         # # else:
         # #     assert left_tangent.shape == (ny, nfreq), 'Left Tangential Direction vector not the correct shape'
 
-        rom_dim = max(np.sum(rc), np.sum(ro))
-        V = np.zeros((nx, rom_dim), dtype=complex)
-        W = np.zeros((nx, rom_dim), dtype=complex)
+        self.lu_factor_all(list(fc) + list(fo))
 
-        we = 0
-        dict_of_luas = dict()
+        V_blocks = []
         for i in range(len(fc)):
             sigma = fc[i]
             if sigma == np.inf:
@@ -544,16 +602,10 @@ class Krylov(rom_interface.BaseRom):
                 lu_A = A
             else:
                 approx_type = 'Pade'
-                try:
-                    lu_A = dict_of_luas[sigma]
-                except KeyError:
-                    lu_A = krylovutils.lu_factor(sigma, A)
-                    dict_of_luas[sigma] = lu_A
-            V[:, we:we+rc[i]] = krylovutils.construct_krylov(rc[i], lu_A, B.dot(right_tangent[:, i:i+1]), approx_type, 'b')
+                lu_A = self.lu_factor(sigma)
+            V_blocks.append(krylovutils.construct_krylov(rc[i], lu_A, B.dot(right_tangent[:, i:i+1]), approx_type, 'b'))
 
-            we += rc[i]
-
-        we = 0
+        W_blocks = []
         for i in range(len(fo)):
             sigma = fo[i]
             if sigma == np.inf:
@@ -561,27 +613,40 @@ class Krylov(rom_interface.BaseRom):
                 lu_A = A
             else:
                 approx_type = 'Pade'
-                try:
-                    lu_A = dict_of_luas[sigma]
-                except KeyError:
-                    lu_A = krylovutils.lu_factor(sigma, A)
-                    dict_of_luas[sigma] = lu_A
-            W[:, we:we+ro[i]] = krylovutils.construct_krylov(ro[i], lu_A, C.T.dot(left_tangent[:, i:i+1]), approx_type, 'c')
+                lu_A = self.lu_factor(sigma)
+            W_blocks.append(krylovutils.construct_krylov(ro[i], lu_A, C.T.dot(left_tangent[:, i:i+1]), approx_type, 'c'))
+
+        # Real projection matrices only if all the spaces are real, i.e. real interpolation points and dense
+        # factorisations (sparse ones are always complex). Any of the spaces may be truncated on breakdown, in which
+        # case the columns in excess on either side are discarded
+        dtype = np.result_type(*V_blocks, *W_blocks)
+        rom_dim = min(sum(Vi.shape[1] for Vi in V_blocks), sum(Wi.shape[1] for Wi in W_blocks))
 
-            we += ro[i]
+        # Column major as both are assembled in blocks of columns
+        V = np.zeros((nx, rom_dim), dtype=dtype, order='F')
+        W = np.zeros((nx, rom_dim), dtype=dtype, order='F')
+
+        we = 0
+        for Vi in V_blocks:
+            ncols = min(Vi.shape[1], rom_dim - we)
+            V[:, we:we+ncols] = Vi[:, :ncols]
+            we += ncols
+
+        we = 0
+        for Wi in W_blocks:
+            ncols = min(Wi.shape[1], rom_dim - we)
+            W[:, we:we+ncols] = Wi[:, :ncols]
+            we += ncols
 
         T = W.T.dot(V)
-        Tinv = sclalg.inv(T)
-        reduction_checks(T, Tinv)
+        V_tinv = solve_v_tinv(T, V)
+        reduction_checks(T, W, V_tinv)
         self.W = W
         self.V = V
 
         # Reduced state space model
-        Ar = W.T.dot(self.ss.A.dot(V.dot(Tinv)))
-        Br = W.T.dot(self.ss.B)
-        Cr = self.ss.C.dot(V.dot(Tinv))
-
-        del dict_of_luas
+        Ar, Br = project(W, self.ss.A, V_tinv, self.ss.B)
+        Cr = self.ss.C.dot(V_tinv)
 
         self.cpu_summary['algorithm'] = time.time() - t0
 
@@ -639,31 +704,42 @@ class Krylov(rom_interface.BaseRom):
         V = None
         W = None
 
+        self.lu_factor_all(frequency)
+
         for i in range(self.nfreq):
 
+            # Factorise once per interpolation point and share it between the controllability and observability spaces
+            if frequency[i] == np.inf or frequency[i].real == np.inf:
+                lu_a = None
+            else:
+                lu_a = self.lu_factor(frequency[i])
+
             if self.settings['single_side'] == 'controllability' or self.settings['single_side'] == '':
                 cout.cout_wrap('\tConstructing controllability space', 1)
                 if i == 0:
-                    V = krylovutils.build_krylov_space(frequency[i], r_c, side='b', a=self.ss.A, b=self.ss.B)
+                    V = krylovutils.build_krylov_space(frequency[i], r_c, side='b', a=self.ss.A, b=self.ss.B,
+                                                       lu_a=lu_a)
                 else:
-                    Vi = krylovutils.build_krylov_space(frequency[i], r_c, side='b', a=self.ss.A, b=self.ss.B)
+                    Vi = krylovutils.build_krylov_space(frequency[i], r_c, side='b', a=self.ss.A, b=self.ss.B,
+                                                        lu_a=lu_a)
                     V = np.hstack((V, Vi))
                     V = krylovutils.mgs_ortho(V)
 
             if self.settings['single_side'] == 'observability' or self.settings['single_side'] == '':
                 cout.cout_wrap('\tConstructing observability space', 1)
                 if i == 0:
-                    W = krylovutils.build_krylov_space(frequency[i], r_o, side='c', a=self.ss.A, b=self.ss.C.T)
+                    W = krylovutils.build_krylov_space(frequency[i], r_o, side='c', a=self.ss.A, b=self.ss.C.T,
+                                                       lu_a=lu_a)
                 else:
-                    Wi = krylovutils.build_krylov_space(frequency[i], r_o, side='c', a=self.ss.A, b=self.ss.C.T)
+                    Wi = krylovutils.build_krylov_space(frequency[i], r_o, side='c', a=self.ss.A, b=self.ss.C.T,
+                                                        lu_a=lu_a)
                     W = np.hstack((W, Wi))
                     W = krylovutils.mgs_ortho(W)
 
         if self.settings['single_side'] == 'controllability' or self.settings['single_side'] == 'observability':
             if self.settings['single_side'] == 'observability':
                 V = W
-            Ar = V.T.dot(self.ss.A.dot(V))
-            Br = V.T.dot(self.ss.B)
+            Ar, Br = project(V, self.ss.A, V, self.ss.B)
             Cr = self.ss.C.dot(V)
 
         else:
@@ -677,13 +753,12 @@ class Krylov(rom_interface.BaseRom):
             # W = krylovutils.mgs_ortho(W)
 
             T = W.T.dot(V)
-            Tinv = sclalg.inv(T)
-            krylovutils.check_eye(T, Tinv)
+            V_tinv = solve_v_tinv(T, V)
+            krylovutils.check_eye(V_tinv, W.T)
 
             # Reduced state space model
-            Ar = W.T.dot(self.ss.A.dot(V.dot(Tinv)))
-            Br = W.T.dot(self.ss.B)
-            Cr = self.ss.C.dot(V.dot(Tinv))
+            Ar, Br = project(W, self.ss.A, V_tinv, self.ss.B)
+            Cr = self.ss.C.dot(V_tinv)
 
         self.W = W
         self.V = V
@@ -691,33 +766,53 @@ class Krylov(rom_interface.BaseRom):
         return Ar, Br, Cr
 
     def mimo_block_arnoldi(self, frequency, r):
+        r"""
+        One-sided projection for MIMO systems using the block Arnoldi construction of the Krylov spaces of all the
+        inputs at once (see :func:`sharpy.rom.utils.krylovutils.block_arnoldi_krylov`).
+
+        The projection is real: for complex interpolation points, the basis spans both the real and imaginary parts
+        of the Krylov space, hence the moments about the complex conjugate point are also matched. The spaces of all
+        interpolation points are merged into a single orthonormal basis.
+
+        Args:
+            frequency (np.ndarray): Array containing the interpolation points
+            r (int): Krylov space order (number of blocks) for each interpolation point
 
-        n = self.ss.states
+        Returns:
+            tuple: The reduced order model matrices: :math:`\mathbf{A}_r`, :math:`\mathbf{B}_r` and :math:`\mathbf{C}_r`.
+        """
 
         A = self.ss.A
         B = self.ss.B
         C = self.ss.C
 
+        self.lu_factor_all(frequency)
+
+        V_blocks = []
         for i in range(self.nfreq):
 
             if self.frequency[i] == np.inf:
+                approx_type = 'partial_realisation'
                 F = A
-                G = B
             else:
-                lu_a = krylovutils.lu_factor(frequency[i], A)
-                F = krylovutils.lu_solve(lu_a, np.eye(n))
-                G = krylovutils.lu_solve(lu_a, B)
+                approx_type = 'Pade'
+                F = self.lu_factor(frequency[i])
+
+            Vi = krylovutils.block_arnoldi_krylov(r, F, B, approx_type)
 
-            if i == 0:
-                V = krylovutils.block_arnoldi_krylov(r, F, G)
+            if np.imag(frequency[i]) == 0:
+                # Real space, other than rounding in the imaginary part if the factorisation is complex (sparse)
+                V_blocks.append(Vi.real)
             else:
-                Vi = krylovutils.block_arnoldi_krylov(r, F, G)
-                V = np.block([V, Vi])
+                V_blocks.append(Vi.real)
+                V_blocks.append(Vi.imag)
+
+        # Orthonormal basis of the union of the spaces, as required by the one-sided projection
+        V = sclalg.orth(np.hstack(V_blocks))
 
         self.V = V
 
-        Ar = V.T.dot(A.dot(V))
-        Br = V.T.dot(B)
+        Ar, Br = project(V, A, V, B)
         Cr = C.dot(V)
 
         return Ar, Br, Cr
@@ -791,7 +886,7 @@ class Krylov(rom_interface.BaseRom):
 
             remove_unstable = np.eye(self.ss.states)
             for mu in unstable_eigenvalues:
-                remove_unstable = np.matmul(remove_unstable, mu * np.eye(self.ss.states) - self.ss.A)
+                remove_unstable = np.matmul(remove_unstable, krylovutils.shifted_matrix(mu, self.ss.A))
 
             self.ss.B = remove_unstable.dot(self.ss.B)
             # self.ss.C = self.ss.C.dot(remove_unstable.T)
@@ -965,11 +1060,49 @@ class Krylov(rom_interface.BaseRom):
         # pass
 
 
-def reduction_checks(T, Tinv):
+def solve_v_tinv(T, V):
+    r"""
+    Computes :math:`\mathbf{VT}^{-1}`, where :math:`\mathbf{T} = \mathbf{W}^\top\mathbf{V}`, through an LU solve of
+    :math:`\mathbf{T}^\top\mathbf{X}^\top = \mathbf{V}^\top` rather than forming the inverse of :math:`\mathbf{T}`.
+
+    Args:
+        T (np.ndarray): Product of the projection matrices :math:`\mathbf{W}^\top\mathbf{V}`
+        V (np.ndarray): Right projection matrix
+
+    Returns:
+        np.ndarray: :math:`\mathbf{VT}^{-1}`
+    """
+    return sclalg.lu_solve(sclalg.lu_factor(T), V.T, trans=1).T
+
+
+def project(W, A, V, B):
+    r"""
+    Computes the reduced order :math:`\mathbf{W}^\top\mathbf{AV}` and :math:`\mathbf{W}^\top\mathbf{B}` with a single
+    product :math:`\mathbf{W}^\top[\mathbf{AV}, \mathbf{B}]`, such that the left projection matrix is only traversed
+    once.
+
+    Args:
+        W (np.ndarray): Left projection matrix
+        A (np.ndarray): State matrix
+        V (np.ndarray): Right projection matrix
+        B (np.ndarray): Input matrix
+
+    Returns:
+        tuple: Reduced order :math:`\mathbf{A}_r` and :math:`\mathbf{B}_r`
+    """
+    AV = A.dot(V)
+    r = AV.shape[1]
+    WtAVB = W.T.dot(np.hstack((AV, B)))
+
+    return WtAVB[:, :r], WtAVB[:, r:]
+
+
+def reduction_checks(T, W, V_tinv):
 
     cout.cout_wrap('Tm condition = %e' % np.linalg.cond(T))
 
-    check_eye(T, Tinv)
+    # W^T V T^{-1} should be the identity
+    check_eye(V_tinv, W.T)
 
 
 def check_eye(T, Tinv, msg=''):
@@ -1,4 +1,5 @@
 """Krylov Model Reduction Methods Utilities"""
+import functools
 import scipy.sparse as scsp
 import numpy as np
 import scipy.linalg as sclalg
@@ -7,36 +8,93 @@ import sharpy.utils.cout_utils as cout
 
 
 def block_arnoldi_krylov(r, F, G, approx_type='Pade', side='controllability'):
+    r"""
+    Block Arnoldi construction of the Krylov space
+
+    .. math:: \mathcal{K}_r((\sigma\mathbf{I}_n - \mathbf{A})^{-1}, (\sigma\mathbf{I}_n - \mathbf{A})^{-1}\mathbf{B})
+
+    for all the :math:`m` columns of :math:`\mathbf{B}` at once (or the equivalent partial realisation space). At each
+    iteration the operator is applied to the whole last block in a single solve (or product) and the new block is
+    orthogonalised against the basis with matrix-matrix products, rather than building the space one vector at a time.
+    Single column inputs are handed to :func:`construct_krylov`.
+
+    Columns of a new block that are numerically linearly dependent on the basis are deflated, hence the block size may
+    decrease along the iterations and the returned basis may have fewer than :math:`mr` columns.
+
+    Args:
+        r (int): Krylov space order, i.e. number of blocks.
+        F (np.ndarray or tuple or SuperLU): For Pade approximations, the LU decomposition of
+            :math:`(\sigma \mathbf{I} - \mathbf{A})` as output from :func:`lu_factor`. For partial realisations it is
+            simply :math:`\mathbf{A}`.
+        G (np.ndarray): If doing the controllability side it should be :math:`\mathbf{B}`, else
+            :math:`\mathbf{C}^T`.
+        approx_type (str): Type of approximation: ``partial_realisation`` or ``Pade``.
+        side (str): Side of the projection ``controllability`` (``b``) or ``observability`` (``c``).
+
+    Returns:
+        np.ndarray: Orthonormal basis of the Krylov space.
+    """
+
+    if side == 'controllability' or side == 'b':
+        transpose_mode = 0
+    elif side == 'observability' or side == 'c':
+        transpose_mode = 1
+    else:
+        raise NameError('Unknown option for side: %s', side)
 
+    G = np.asarray(G)
     n = G.shape[0]
     m = G.shape[1]
 
-    Q0, R0, P0 = sclalg.qr(G, pivoting=True)
-    Q0 = Q0[:, :m]
-
-    Q = np.zeros((n,m*r), dtype=complex)
-    V = np.zeros((n,m*r), dtype=complex)
+    if m == 1:
+        return construct_krylov(r, F, G, approx_type, {0: 'b', 1: 'c'}[transpose_mode])
 
-    for k in range(r):
+    deflation_tolerance = 1e-6  # relative to the largest column of the block prior to its orthogonalisation
 
-        if k == 0:
-            Q[:, 0:m] = F.dot(Q0)
+    if approx_type == 'partial_realisation':
+        if transpose_mode == 1:
+            F = F.T
+        dtype = np.result_type(F.dtype, G.dtype, float)
+        X = G
+    else:
+        if isinstance(F, tuple):
+            dtype = np.result_type(F[0].dtype, G.dtype, float)
         else:
-            Q[:, k*m: k*m + m] = F.dot(Q[:, (k-1)*m:(k-1)*m + m])
+            dtype = complex  # sparse factorisations are always complex, see lu_factor()
+        X = lu_solve(F, G, transpose_mode)
 
-        Q[:, :k*m + m] = mgs_ortho(Q[:, :k*m+m])
+    V = np.zeros((n, m * r), dtype=dtype, order='F')
+    k_block = 0  # first column of the last block
+    k = 0  # number of columns in the basis
 
-        Qf, R, P = sclalg.qr(Q[:, k*m: k*m + m], pivoting=True)
-        Q[:, k*m: k*m + m ] = Qf[:, :m]
-        if R[0,0] >= 1e-6:
-            V[:, k*m:k*m + m] = Q[:, k*m: k*m + m ]
-        else:
-            print('Deflating')
-            k -= 1
+    for i in range(r):
+        if i > 0:
+            # All vectors in the last block in one go
+            if approx_type == 'partial_realisation':
+                X = F.dot(V[:, k_block:k])
+            else:
+                X = lu_solve(F, V[:, k_block:k], transpose_mode)
+        X = np.array(X, dtype=dtype)
+        norm_x = np.max(np.linalg.norm(X, axis=0))
 
-    V = mgs_ortho(V)
+        # Block classical Gram-Schmidt, applied twice to retain orthogonality in finite precision
+        Vk = V[:, :k]
+        for _ in range(2):
+            X -= Vk.dot(Vk.conj().T.dot(X))
 
-    return V
+        # Rank revealing QR of the new block to orthonormalise it and deflate linearly dependent vectors
+        Q, R, _ = sclalg.qr(X, mode='economic', pivoting=True)
+        rank = np.sum(np.abs(np.diag(R)) > deflation_tolerance * norm_x)
+        if rank < X.shape[1]:
+            cout.cout_wrap('\tDeflating %g vectors at Krylov order %g' % (X.shape[1] - rank, i), 2)
+        if rank == 0:
+            break
+
+        V[:, k:k+rank] = Q[:, :rank]
+        k_block = k
+        k += rank
+
+    return V[:, :k]
 
 
 def mgs_ortho(X):
@@ -60,7 +118,7 @@ def mgs_ortho(X):
     n = X.shape[1]
     m = X.shape[0]
 
-    Q = np.zeros((m, n), dtype=float)
+    Q = np.zeros((m, n), dtype=float, order='F')  # built column-wise
 
     for i in range(n):
         w = X[:, i]
@@ -103,8 +161,8 @@ def construct_krylov(r, lu_A, B, approx_type='Pade', side='b'):
 
         Pade Approximation:
 
-        >>> V = construct_krylov(r, (sigma * np.eye(nx) - A), B, 'Pade', 'b')
-        >>> W = construct_krylov(r, (sigma * np.eye(nx) - A), C.T, 'Pade', 'c')
+        >>> V = construct_krylov(r, shifted_matrix(sigma, A), B, 'Pade', 'b')
+        >>> W = construct_krylov(r, shifted_matrix(sigma, A), C.T, 'Pade', 'c')
 
 
     References:
@@ -113,80 +171,119 @@ def construct_krylov(r, lu_A, B, approx_type='Pade', side='b'):
 
     Args:
         r (int): Krylov space order
-        lu_A (np.ndarray): For Pade approximations it should be the LU decomposition of :math:`(\sigma I - \mathbf{A})`
-            in tuple form, as output from the :func:`scipy.linalg.lu_factor`. For partial realisations it is
-            simply :math:`\mathbf{A}`.
+        lu_A (np.ndarray or tuple): For Pade approximations it should be the LU decomposition of
+            :math:`(\sigma I - \mathbf{A})` in tuple form, as output from the :func:`scipy.linalg.lu_factor`, or a
+            ``SuperLU`` object. If the shifted matrix :math:`(\sigma I - \mathbf{A})` is given instead, it is factorised
+            here. For partial realisations it is simply :math:`\mathbf{A}`.
         B (np.ndarray): If doing the B side it should be :math:`\mathbf{B}`, else :math:`\mathbf{C}^T`.
         approx_type (str): Type of approximation: ``partial_realisation`` or ``Pade``.
         side: Side of the projection ``b`` or ``c``.
 
     Returns:
-        np.ndarray: Projection matrix
+        np.ndarray: Projection matrix. It is real valued if both the operator and ``B`` are real. If the Krylov space
+        is found to be invariant before order ``r`` is reached (lucky breakdown), the returned basis is truncated to
+        the invariant space and has fewer than ``r`` columns.
 
     """
 
     nx = B.shape[0]
+    # Single input (output) vector. Reshaped rather than setting B.shape, which would modify the caller's array
+    b_vec = np.asarray(B).reshape(nx)
 
     # Side indicates projection side. if using C then it needs to be transposed
     if side == 'c':
         transpose_mode = 1
-        B.shape = (nx, 1)
     else:
         transpose_mode = 0
-        B.shape = (nx, 1)
 
-    # Output projection matrices
+    if approx_type != 'partial_realisation' and not isinstance(lu_A, (tuple, scsp.linalg.SuperLU)):
+        # Shifted matrix given rather than its factorisation. Callers building both the B and C sides should
+        # factorise once and pass the factors to avoid repeating the decomposition
+        if scsp.issparse(lu_A):
+            lu_A = scsp.linalg.splu(scsp.csc_matrix(lu_A))
+        else:
+            lu_A = sclalg.lu_factor(lu_A)
+
+    # Work in real arithmetic unless the operator or the input vector are complex (i.e. complex interpolation points)
+    if approx_type == 'partial_realisation':
+        dtype = np.result_type(lu_A.dtype, b_vec.dtype, float)
+    elif isinstance(lu_A, tuple):
+        dtype = np.result_type(lu_A[0].dtype, b_vec.dtype, float)
+    else:
+        dtype = complex  # sparse factorisations are always complex, see lu_factor()
+
+    # Output projection matrices. Both are filled column by column and V is stored column major such that the panels
+    # V[:, :j] can be handed to BLAS without copies
     V = np.zeros((nx, r),
-                 dtype=complex)
+                 dtype=dtype, order='F')
     H = np.zeros((r, r),
-                 dtype=complex)
+                 dtype=dtype, order='F')
 
     # Declare iterative variables
-    f = np.zeros((nx, r),
-                 dtype=complex)
+    h = np.empty(r, dtype=dtype)
+    reorthogonalisation_ratio = 1 / np.sqrt(2)
+    breakdown_tolerance = 1e-12
+    gemv, nrm2 = sclalg.get_blas_funcs(('gemv', 'nrm2'), (V,))
+
+    # Resolve the operator applied at every iteration once, such that the loop does not go through the lu_solve()
+    # type dispatch nor the finiteness checks of scipy on each call
+    if approx_type == 'partial_realisation':
+        if scsp.issparse(lu_A):
+            krylov_operator = lu_A.dot
+        else:
+            krylov_operator = np.asarray(lu_A).dot  # products with np.matrix would return 2D rows
+    elif type(lu_A) == scsp.linalg.SuperLU:
+        krylov_operator = functools.partial(lu_A.solve, trans={0: 'N', 1: 'T'}[transpose_mode])
+    else:
+        krylov_operator = functools.partial(sclalg.lu_solve, lu_A, trans=transpose_mode, check_finite=False)
 
     if approx_type == 'partial_realisation':
-        A = lu_A
-        v_arb = B
-        v = v_arb / np.linalg.norm(v_arb)
-        w = A.dot(v)
+        v_arb = b_vec
+        v = v_arb / nrm2(v_arb)
+        w = krylov_operator(v)
     else:
         # LU decomposition
-        v = lu_solve(lu_A, B, trans=transpose_mode)
-        v = v / np.linalg.norm(v)
-        w = lu_solve(lu_A, v)
+        v = krylov_operator(b_vec)
+        v = v / nrm2(v)
+        w = krylov_operator(v)
 
-    alpha = v.T.dot(w)
+    alpha = np.vdot(v, w)
+    norm_w = nrm2(w)
 
-    # Initial assembly
-    f[:, :1] = w - v.dot(alpha)
-    V[:, :1] = v
+    # Initial assembly. Only the residual of the current iteration is kept
+    f = w - alpha * v
+    V[:, 0] = v
     H[0, 0] = alpha
 
     for j in range(0, r-1):
 
-        beta = np.linalg.norm(f[:, j])
-        v = 1 / beta * f[:, j]
+        beta = nrm2(f)
+        if beta < breakdown_tolerance * norm_w:
+            # Lucky breakdown - the residual vanished relative to the last operator product, thus the Krylov space
+            # is invariant and further vectors would only be rounding error
+            return V[:, :j+1]
+        v = 1 / beta * f
 
         V[:, j+1] = v
-        H_hat = np.block([[H[:j+1, :j+1]],
-                          [beta * evec(j)]])
+        H[j+1, j] = beta
 
-        if approx_type == 'partial_realisation':
-            w = A.dot(v)
-        else:
-            w = lu_solve(lu_A, v, trans=transpose_mode)
+        w = krylov_operator(v)
 
-        h = V[:, :j+2].T.dot(w)
-        f[:, j+1] = w - V[:, :j+2].dot(h)
+        # Gram-Schmidt against the current basis: h = V^H w (trans=2) followed by f = w - V h, accumulated in place
+        # on w (beta=1)
+        Vj = V[:, :j+2]
+        norm_w = nrm2(w)
+        h[:j+2] = gemv(1., Vj, w, trans=2)
+        f = gemv(-1., Vj, h[:j+2], beta=1., y=w, overwrite_y=1)
 
-        # Finite precision
-        s = V[:, :j+2].T.dot(f[:, j+1])
-        f[:, j+1] = f[:, j+1] - V[:, :j+2].dot(s)
-        h += s
+        # Finite precision - reorthogonalise only if the projection cancelled most of w, i.e. orthogonality may have
+        # been lost (DGKS criterion)
+        if nrm2(f) < reorthogonalisation_ratio * norm_w:
+            s = gemv(1., Vj, f, trans=2)
+            f = gemv(-1., Vj, s, beta=1., y=f, overwrite_y=1)
+            h[:j+2] += s
 
-        h.shape = (j+2, 1)  # Enforce shape for concatenation
-        H[:j+2, :j+2] = np.block([H_hat, h])
+        H[:j+2, j+1] = h[:j+2]
 
     return V
 
@@ -199,8 +296,11 @@ def lu_factor(sigma, A):
 
     In the case of ``A`` being a sparse matrix, the sparse methods in scipy are employed
 
+    For dense matrices, complex valued expansion frequencies with a zero imaginary part are treated as real, such
+    that the factorisation (and the Krylov spaces built with it) remain in real arithmetic for real systems.
+
     Args:
-        sigma (float): Expansion frequency
+        sigma (float or complex): Expansion frequency
         A (csc_matrix or np.ndarray): Dynamics matrix
 
     Returns:
@@ -210,7 +310,31 @@ def lu_factor(sigma, A):
     if type(A) == libsp.csc_matrix:
         return scsp.linalg.splu(sigma * scsp.identity(n, dtype=complex, format='csc') - A)
     else:
-        return sclalg.lu_factor(sigma * np.eye(n) - A)
+        if np.imag(sigma) == 0:
+            sigma = np.real(sigma)
+        return sclalg.lu_factor(shifted_matrix(sigma, A), overwrite_a=True)
+
+
+def shifted_matrix(sigma, A):
+    r"""
+    Shifted dense matrix
+
+    .. math:: \sigma \mathbf{I} - \mathbf{A}
+
+    assembled without forming the identity: a copy of ``A`` is negated and ``sigma`` is added to its diagonal in place.
+
+    Args:
+        sigma (float or complex): Shift
+        A (np.ndarray): Square matrix
+
+    Returns:
+        np.ndarray: Shifted matrix. It is complex if either ``sigma`` or ``A`` are complex.
+    """
+    n = A.shape[0]
+    sigma_a = np.array(A, dtype=np.result_type(A.dtype, sigma))
+    np.negative(sigma_a, out=sigma_a)
+    sigma_a.flat[::n+1] += sigma
+    return sigma_a
 
 
 def lu_solve(lu_A, b, trans=0):
@@ -345,14 +469,15 @@ def construct_mimo_krylov(r, lu_A_input, B, approx_type='Pade', side='controllab
     return V[:, :t]
 
 
-def build_krylov_space(frequency, r, side, a, b):
+def build_krylov_space(frequency, r, side, a, b, lu_a=None):
 
     if frequency == np.inf or frequency.real == np.inf:
         approx_type = 'partial_realisation'
         lu_a = a
     else:
         approx_type = 'Pade'
-        lu_a = lu_factor(frequency, a)
+        if lu_a is None:
+            lu_a = lu_factor(frequency, a)
 
     try:
         nu = b.shape[1]
@@ -369,27 +494,6 @@ def build_krylov_space(frequency, r, side, a, b):
     return v
 
 
-def evec(j):
-    """j-th unit vector (in row format)
-
-    Args:
-        j: Unit vector dimension
-
-    Returns:
-        np.ndarray: j-th unit vector
-
-    Examples:
-        >>> evec(2)
-        np.array([0, 1])
-        >>> evec(3)
-        np.array([0, 0, 1])
-
-    """
-    e = np.zeros(j+1)
-    e[j] = 1
-    return e
-
-
 def schur_ordered(A, ct=False):
     r"""Returns block ordered complex Schur form of matrix :math:`\mathbf{A}`
 
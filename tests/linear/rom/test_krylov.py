@@ -4,6 +4,7 @@ Test Krylov ROM using Hospital Building Model
 
 import os
 import unittest
+import warnings
 import numpy as np
 import sharpy.utils.cout_utils as cout
 import scipy.io as scio
@@ -78,6 +79,50 @@ class TestKrylov(unittest.TestCase):
                                  'frequency': algorithm_list[algorithm]['frequency']}
                 self.run_test(test_settings)
 
+    def test_lu_cache(self):
+        self.rom.initialise({'algorithm': 'one_sided_arnoldi',
+                             'r': 8,
+                             'frequency': np.array([0])})
+
+        ssrom = self.rom.run(self.ss)
+        lu_a = self.rom.lu_cache[0]
+
+        # Same system: the factorisation is reused
+        ssrom_cached = self.rom.run(self.ss)
+        assert self.rom.lu_cache[0] is lu_a, 'LU factorisation not reused for the same system'
+        np.testing.assert_allclose(ssrom_cached.A, ssrom.A)
+
+        # New plant matrix: the cache is cleared
+        ss_new = libss.ss(2 * self.ss.A, self.ss.B, self.ss.C, self.ss.D)
+        self.rom.run(ss_new)
+        assert self.rom.lu_cache[0] is not lu_a, 'LU factorisation cache not cleared for a new system'
+        assert len(self.rom.lu_cache) == 1
+
+    def test_single_point(self):
+        for algorithm in ['one_sided_arnoldi', 'two_sided_arnoldi']:
+            with self.subTest(algorithm=algorithm):
+                self.rom.initialise({'algorithm': algorithm,
+                                     'r': 4,
+                                     'frequency': np.array([0.5, 2.]),
+                                     'print_info': False})
+                with self.assertRaises(ValueError):
+                    self.rom.run(self.ss)
+
+    def test_sparse(self):
+        # Sparse factorisations are complex: the projection matrices must not be cast to real
+        ss = libss.ss(libsp.csc_matrix(self.ss.A), self.ss.B, self.ss.C, self.ss.D)
+        sigma = 0.5
+        self.rom.initialise({'algorithm': 'dual_rational_arnoldi',
+                             'r': 6,
+                             'frequency': np.array([sigma])})
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', np.ComplexWarning)
+            ssrom = self.rom.run(ss)
+
+        H = self.ss.C.dot(np.linalg.solve(sigma * np.eye(self.ss.states) - self.ss.A, self.ss.B))
+        Hr = ssrom.C.dot(np.linalg.solve(sigma * np.eye(ssrom.states) - ssrom.A, ssrom.B))
+        np.testing.assert_allclose(Hr, H, rtol=1e-8)
+
     def tearDown(self):
         import shutil
         shutil.rmtree(self.test_dir + '/figs/')
@@ -0,0 +1,140 @@
+"""Test Krylov space construction utilities
+
+"""
+
+import unittest
+import numpy as np
+import scipy.linalg as sclalg
+import sharpy.rom.utils.krylovutils as krylovutils
+import sharpy.rom.krylov as krylov
+import sharpy.linear.src.libss as libss
+import sharpy.utils.cout_utils as cout
+
+
+def subspace_residual(V, K):
+    """Norm of the component of range(K) outside range(V), for V with orthonormal columns"""
+    Q = sclalg.orth(K)
+    return np.linalg.norm(Q - V.dot(V.conj().T.dot(Q)))
+
+
+class TestKrylovSpaces(unittest.TestCase):
+
+    def setUp(self):
+        cout.cout_wrap.initialise(False, False)
+        rng = np.random.RandomState(0)
+        self.nx = 40
+        self.A = rng.randn(self.nx, self.nx) / np.sqrt(self.nx) - np.eye(self.nx)
+        self.B = rng.randn(self.nx, 3)
+        self.C = rng.randn(2, self.nx)
+
+    def test_construct_krylov(self):
+        """
+        Pade spaces of both sides against the explicit Krylov spaces of :math:`(\\sigma I - A)^{-1}` and its transpose
+        """
+        r = 5
+        b = self.B[:, :1]
+        c_t = self.C[:1, :].T
+        for sigma in [0.5, 0.5 + 1j]:
+            with self.subTest(sigma=sigma):
+                inv_a = np.linalg.inv(sigma * np.eye(self.nx) - self.A)
+                lu_a = krylovutils.lu_factor(sigma, self.A)
+
+                V = krylovutils.construct_krylov(r, lu_a, b, 'Pade', 'b')
+                K = np.hstack([np.linalg.matrix_power(inv_a, k + 1).dot(b) for k in range(r)])
+                np.testing.assert_allclose(V.conj().T.dot(V), np.eye(r), atol=1e-12)
+                assert subspace_residual(V, K) < 1e-10, 'Controllability space not spanned'
+
+                W = krylovutils.construct_krylov(r, lu_a, c_t, 'Pade', 'c')
+                K = np.hstack([np.linalg.matrix_power(inv_a.T, k + 1).dot(c_t) for k in range(r)])
+                np.testing.assert_allclose(W.conj().T.dot(W), np.eye(r), atol=1e-12)
+                assert subspace_residual(W, K) < 1e-10, 'Observability space not spanned'
+
+    def test_breakdown(self):
+        """
+        Input vector in an A-invariant subspace of dimension 3: the Krylov space is truncated to it and the reducers
+        return the (exact) order 3 ROM
+        """
+        r = 6
+        n_invariant = 3
+        A = self.A.copy()
+        A[n_invariant:, :n_invariant] = 0.
+        B = np.zeros((self.nx, 1))
+        B[:n_invariant, 0] = self.B[:n_invariant, 0]
+        C = self.C[:1, :]
+        D = np.zeros((1, 1))
+
+        for sigma in [0.5, np.inf]:
+            if sigma == np.inf:
+                V = krylovutils.construct_krylov(r, A, B, 'partial_realisation', 'b')
+            else:
+                V = krylovutils.construct_krylov(r, krylovutils.lu_factor(sigma, A), B, 'Pade', 'b')
+            assert V.shape[1] < r, 'Krylov space not truncated on breakdown'
+            assert V.shape[1] == n_invariant
+            np.testing.assert_allclose(V.conj().T.dot(V), np.eye(n_invariant), atol=1e-12)
+
+        wv = np.array([0.1, 1., 10.])
+        for algorithm in ['two_sided_arnoldi', 'dual_rational_arnoldi']:
+            with self.subTest(algorithm=algorithm):
+                ss = libss.ss(A, B, C, D)
+                rom = krylov.Krylov()
+                rom.initialise({'algorithm': algorithm,
+                                'r': r,
+                                'frequency': np.array([0.5])})
+                ssrom = rom.run(ss)
+
+                assert ssrom.A.shape == (n_invariant, n_invariant)
+                assert ssrom.B.shape == (n_invariant, 1)
+                assert ssrom.C.shape == (1, n_invariant)
+                assert rom.V.shape == rom.W.shape
+
+                Y_fom = ss.freqresp(wv)
+                Y_rom = ssrom.freqresp(wv)
+                np.testing.assert_allclose(Y_rom, Y_fom, rtol=1e-8)
+
+    def test_block_arnoldi_krylov(self):
+        r = 4
+        sigma = 0.5
+        lu_a = krylovutils.lu_factor(sigma, self.A)
+        inv_a = np.linalg.inv(sigma * np.eye(self.nx) - self.A)
+
+        V = krylovutils.block_arnoldi_krylov(r, lu_a, self.B)
+        K = np.hstack([np.linalg.matrix_power(inv_a, k + 1).dot(self.B) for k in range(r)])
+        assert V.shape[1] == r * self.B.shape[1]
+        np.testing.assert_allclose(V.conj().T.dot(V), np.eye(V.shape[1]), atol=1e-12)
+        assert subspace_residual(V, K) < 1e-10, 'Krylov space not spanned'
+
+        # Linearly dependent input: one column per block is deflated
+        B_dependent = np.hstack((self.B, self.B[:, :1] + self.B[:, 1:2]))
+        V = krylovutils.block_arnoldi_krylov(r, lu_a, B_dependent)
+        assert V.shape[1] == r * self.B.shape[1], 'Linearly dependent vectors not deflated'
+        np.testing.assert_allclose(V.conj().T.dot(V), np.eye(V.shape[1]), atol=1e-12)
+        assert subspace_residual(V, K) < 1e-10, 'Krylov space not spanned'
+
+    def test_mimo_block_arnoldi(self):
+        """
+        Moments matched by the one-sided block Arnoldi ROM about real, complex and multiple interpolation points
+        """
+        r = 3
+        ss = libss.ss(self.A, self.B, self.C, np.zeros((self.C.shape[0], self.B.shape[1])))
+
+        for frequency in [[0.], [1j], [0., 2.]]:
+            with self.subTest(frequency=frequency):
+                rom = krylov.Krylov()
+                rom.initialise({'algorithm': 'mimo_block_arnoldi',
+                                'r': r,
+                                'frequency': np.array(frequency)})
+                ssrom = rom.run(ss)
+
+                assert not np.iscomplexobj(ssrom.A), 'Complex ROM'
+                for sigma in frequency:
+                    inv_a = np.linalg.inv(sigma * np.eye(self.nx) - self.A)
+                    inv_ar = np.linalg.inv(sigma * np.eye(ssrom.states) - ssrom.A)
+                    for k in range(r):
+                        moment = self.C.dot(np.linalg.matrix_power(inv_a, k + 1).dot(self.B))
+                        moment_r = ssrom.C.dot(np.linalg.matrix_power(inv_ar, k + 1).dot(ssrom.B))
+                        np.testing.assert_allclose(moment_r, moment, rtol=0, atol=1e-10 * np.max(np.abs(moment)),
+                                                   err_msg='Moment %d at sigma = %s not matched' % (k, sigma))
+
+
+if __name__ == '__main__':
+    unittest.main()